@@ -1,4 +1,7 @@
 from typing import Any, List, Set, Dict, Tuple
+import array
+import functools
+import itertools
 import random
 from abc import ABC, abstractmethod
 
@@ -10,18 +13,75 @@ class Card:
         self.type = type
 
 
+HAND_SIZE = 10
+
+COLOUR_ID = {"green": 0, "yellow": 1, "red": 2, "blue": 3, "black": 4}
+
+
+def mask_positions(mask: int) -> List[int]:
+    positions: List[int] = []
+    while mask:
+        low_bit = mask & -mask
+        positions.append(low_bit.bit_length()-1)
+        mask ^= low_bit
+    return positions
+
+
+@functools.lru_cache(maxsize=None)
+def k_subset_masks(mask: int, count: int) -> List[int]:
+    # only 2^HAND_SIZE distinct masks exist, so every pattern is
+    # enumerated at most once per process
+    bits = [1 << pos for pos in mask_positions(mask)]
+    combination_masks: List[int] = []
+    for combination in itertools.combinations(bits, count):
+        combination_mask = 0
+        for bit in combination:
+            combination_mask |= bit
+        combination_masks.append(combination_mask)
+    return combination_masks
+
+
 class Hand:
     def __init__(self, cards: List[Card]):
-        if len(cards) < 10 or len(cards) > 10:
+        if len(cards) < HAND_SIZE or len(cards) > HAND_SIZE:
             raise Exception("Invalid number of cards")
         self.cards = cards
+        self.numbers = array.array('b', [card.number for card in cards])
+        self.colours = array.array(
+            'b', [COLOUR_ID[card.colour] for card in cards])
+        self.possibility_cache: Dict[Tuple, List[int]] = {}
+        self.verdict_cache: Dict[Tuple, bool] = {}
+        # bit i set <=> card i belongs to the bucket
+        self.by_number: List[int] = [0] * 13
+        self.by_colour: Dict[int, int] = {}
+        self.jokers = 0
+        self.all_positions = 0
+        for i, card in enumerate(cards):
+            bit = 1 << i
+            self.all_positions |= bit
+            if card.number == -1:
+                self.jokers |= bit
+            else:
+                self.by_number[card.number] |= bit
+            colour_id = COLOUR_ID[card.colour]
+            self.by_colour[colour_id] = self.by_colour.get(
+                colour_id, 0) | bit
+        self.available_numbers = [number for number in range(
+            1, 13) if self.by_number[number]]
+        self.available_colours = [
+            colour for colour in self.by_colour if colour != COLOUR_ID["black"]]
+        # candidate lists shared by every SameNumber/SameColour instance
+        self.number_candidates = [(-1, number)
+                                  for number in self.available_numbers]
+        self.colour_candidates = [(colour, -1)
+                                  for colour in self.available_colours]
 
     def print(self):
         for i, card in enumerate(self.cards):
             print('Card {}: C: {}/N:{}'.format(i, card.colour, card.number))
 
 
-def init_deck():
+def build_deck() -> List[Card]:
     deck: List[Card] = []
     colours = ["green", "yellow", "red", "blue"]
     for colour in colours:
@@ -30,11 +90,24 @@ def init_deck():
     for i in range(8):
         deck.append(Card("black", -1, "joker"))
 
+    return deck
+
+
+# the cards never change, only which ones get dealt
+DECK = build_deck()
+
+
+def init_deck():
+    deck = DECK[:]
     random.shuffle(deck)
 
     return deck
 
 
+def generate_hands(count: int) -> List[Hand]:
+    return [Hand(random.sample(DECK, HAND_SIZE)) for _ in range(count)]
+
+
 deck = init_deck()
 
 hand = Hand(deck[0:10])
@@ -43,19 +116,32 @@ hand.print()
 
 class Condition(ABC):
 
-    def __init__(self, required_number: int, sub_conditions: Set['Condition'] = []) -> None:
+    def __init__(self, required_number: int, sub_conditions: Tuple['Condition', ...] = ()) -> None:
         super().__init__()
         self.required_number = required_number
-        self.sub_conditions = sub_conditions
+        self.sub_conditions = tuple(sub_conditions)
 
     def hand_passed(self, hand: Hand) -> bool:
-        possibilities = self.possibilities(hand)
-        if(len(possibilities) > 0):
-            return True
-        return False
+        return self.has_possibility(hand)
+
+    def has_possibility(self, hand: Hand) -> bool:
+        return len(self.possibilities(hand)) > 0
+
+    def cache_key(self) -> Tuple[str, int]:
+        return (type(self).__name__, self.required_number)
+
+    def possibilities(self, hand: Hand) -> List[int]:
+        key = self.cache_key()
+        if key is None:
+            return self.find_possibilities(hand)
+        cached = hand.possibility_cache.get(key)
+        if cached is None:
+            cached = self.find_possibilities(hand)
+            hand.possibility_cache[key] = cached
+        return cached
 
     @abstractmethod
-    def possibilities(self, hand: Hand) -> List[Set[int]]:
+    def find_possibilities(self, hand: Hand) -> List[int]:
         pass
 
 
@@ -63,199 +149,196 @@ class SetBased(Condition):
     def __init__(self, required_number: int) -> None:
         super().__init__(required_number)
 
-    def internal_possibilities(self, prefix: Set[int], sub_range: List[int], remaining_levels: int) -> List[Set[int]]:
-        remover_idx = 0
-        sub_combinations: List[Set[int]] = []
-        if remaining_levels == 1:
-            for rem in range(len(sub_range)):
-                list_modified = sub_range[:]
-                del list_modified[rem]
-                sub_combinations.append(set(list_modified).union(prefix))
-        else:
-            for rem in range(len(sub_range)-remaining_levels+1):
-                list_modified = sub_range[:]
-                del list_modified[rem]
-                prefix_ = set(list_modified[0:rem])
-                sub_range_ = list_modified[rem:]
-                possibilities = self.internal_possibilities(
-                    prefix_, sub_range_, remaining_levels-1)
-                sub_combinations.extend(possibilities)
-        for sub_combination in sub_combinations:
-            sub_combination.update(prefix)
-
-        return sub_combinations
+    def mask_combinations(self, mask: int) -> List[int]:
+        return k_subset_masks(mask, self.required_number)
 
     @abstractmethod
-    def find_matches(self, hand: Hand, colour: str = "any", number: int = -1) -> List[Set[int]]:
+    def find_matches(self, hand: Hand, colour: int = -1, number: int = -1) -> List[int]:
         pass
 
     @abstractmethod
-    def candidates(self, hand: Hand) -> List[Tuple[str, int]]:
+    def candidates(self, hand: Hand) -> List[Tuple[int, int]]:
         pass
 
-    def possibilities(self, hand: Hand) -> List[Set[int]]:
-        possibilities = []
+    def find_possibilities(self, hand: Hand) -> List[int]:
+        # joker-heavy combinations recur for every candidate, dedup them
+        possibilities: Set[int] = set()
         candidates = self.candidates(hand)
         for candidate in candidates:
             candidate_possibilities = self.find_matches(
                 hand, candidate[0], candidate[1])
-            possibilities.extend(candidate_possibilities)
-        return possibilities
+            possibilities.update(candidate_possibilities)
+        return list(possibilities)
 
 
 class ListBased(Condition):
     def __init__(self, required_number: int) -> None:
         super().__init__(required_number)
 
-    def get_combinations(self, remaining_list: List[Set[int]]) -> List[Set[int]]:
-        combinations: List[Set[int]] = []
-        if len(remaining_list) == 1:
-
-            return [set([pos]) for pos in remaining_list[0]]
-        else:
-            sub_combinations = self.get_combinations(remaining_list[1:])
-            for position in remaining_list[0]:
-                for sub_combination in sub_combinations:
-                    extended_set = sub_combination.union([position])
-                    combinations.append(extended_set)
-        return combinations
-
-    def get_possibilities(self, full_list: List[Set[int]]) -> List[Set[int]]:
-        sub_combinations: List[Set[int]] = []
+    def fused_combinations(self, hand: Hand, full_list: List[int], index: int, remaining: int, acc: int):
+        if remaining == 0:
+            yield acc
+            return
+        for position in mask_positions(full_list[index]):
+            yield from self.fused_combinations(
+                hand, full_list, index+1, remaining-1, acc | 1 << position)
 
+    def get_possibilities(self, hand: Hand, full_list: List[int]):
         for i in range(len(full_list)-self.required_number+1):
-            sub_range = full_list[i:self.required_number+i]
-
-            combinations_on_list = self.get_combinations(sub_range)
+            yield from self.fused_combinations(hand, full_list, i, self.required_number, 0)
 
-            sub_combinations.extend(combinations_on_list)
-        return sub_combinations
-
-    def possibilities(self, hand: Hand) -> List[Set[int]]:
+    def find_possibilities(self, hand: Hand) -> List[int]:
         possibilities = []
-        candidates = self.candidates(hand)
         current_number = 1
 
         while current_number <= 12:
-            streak: List[Set[int]] = []
-            available_jokers = list(filter(
-                lambda card: card[1].number == -1, candidates))
+            streak: List[int] = []
+            available_jokers = mask_positions(hand.jokers)
             streak_broken = False
 
             while not streak_broken:
-                number_cards = list(filter(
-                    lambda card: card[1].number == current_number, candidates))
-                if len(number_cards) == 0 and len(available_jokers) > 0:
-                    streak.append(set([available_jokers.pop()[0]]))
-                elif len(number_cards) > 0:
-                    streak.append(set([card[0] for card in number_cards]))
+                # jokers may stretch a streak beyond number 12
+                number_mask = hand.by_number[current_number] if current_number <= 12 else 0
+                if number_mask == 0 and len(available_jokers) > 0:
+                    streak.append(1 << available_jokers.pop())
+                elif number_mask != 0:
+                    streak.append(number_mask)
                 else:
                     streak_broken = True
                 current_number += 1
-            possibilities.extend(self.get_possibilities(streak))
+            possibilities.extend(self.get_possibilities(hand, streak))
         return possibilities
 
-    @ abstractmethod
-    def candidates(self, hand: Hand) -> List[Card]:
-        pass
-
 
 class SameNumber(SetBased):
     def __init__(self, required_number: int) -> None:
         super().__init__(required_number)
 
-    def candidates(self, hand: Hand) -> List[Tuple[str, int]]:
-        available_numbers = set(
-            [card.number for card in hand.cards if card.number != -1])
-        return [("any", number) for number in available_numbers]
+    def candidates(self, hand: Hand) -> List[Tuple[int, int]]:
+        return hand.number_candidates
+
+    def has_possibility(self, hand: Hand) -> bool:
+        for number in hand.available_numbers:
+            if (hand.by_number[number] | hand.jokers).bit_count() >= self.required_number:
+                return True
+        return False
 
-    def find_matches(self, hand: Hand, colour: str = "any", number: int = -1) -> List[Set[int]]:
-        # return super().find_matches(colour, number)
-        matches: List[int] = []
-        for i, card in enumerate(hand.cards):
-            if card.number == number or card.number == -1:
-                matches.append(i)
+    def find_matches(self, hand: Hand, colour: int = -1, number: int = -1) -> List[int]:
+        mask = hand.by_number[number] | hand.jokers
 
-        if len(matches) < self.required_number:
+        matched = mask.bit_count()
+        if matched < self.required_number:
             return []
 
-        if len(matches) == self.required_number:
-            return [set(matches)]
-        return self.internal_possibilities(set(), matches, len(matches)-self.required_number)
+        if matched == self.required_number:
+            return [mask]
+        return self.mask_combinations(mask)
 
 
 class SameColour(SetBased):
     def __init__(self, required_number: int) -> None:
         super().__init__(required_number)
 
-    def candidates(self, hand: Hand) -> List[Tuple[str, int]]:
-        available_colours = set(
-            [card.colour for card in hand.cards if "black" not in card.colour])
-        return [(colour, -1) for colour in available_colours]
+    def candidates(self, hand: Hand) -> List[Tuple[int, int]]:
+        return hand.colour_candidates
+
+    def has_possibility(self, hand: Hand) -> bool:
+        for colour in hand.available_colours:
+            if (hand.by_colour[colour] | hand.jokers).bit_count() >= self.required_number:
+                return True
+        return False
 
-    def find_matches(self, hand: Hand, colour: str = "any", number: int = -1) -> List[Set[int]]:
-        # return super().find_matches(colour, number)
-        matches: List[int] = []
-        for i, card in enumerate(hand.cards):
-            if card.colour == colour or card.number == -1:
-                matches.append(i)
+    def find_matches(self, hand: Hand, colour: int = -1, number: int = -1) -> List[int]:
+        mask = hand.by_colour.get(colour, 0) | hand.jokers
 
-        if len(matches) < self.required_number:
+        matched = mask.bit_count()
+        if matched < self.required_number:
             return []
 
-        if len(matches) == self.required_number:
-            return [set(matches)]
-        return self.internal_possibilities(set(), matches, len(matches)-self.required_number)
+        if matched == self.required_number:
+            return [mask]
+        return self.mask_combinations(mask)
 
 
 class AnyList(ListBased):
     def __init__(self, required_number: int) -> None:
         super().__init__(required_number)
 
-    def candidates(self, hand: Hand) -> List[Card]:
-        return sorted(enumerate(hand.cards), key=lambda card: card[1].number)
-
 
 class SameColourList(AnyList):
     def __init__(self, required_number: int) -> None:
         super().__init__(required_number)
 
-    def all_same_colour(self, hand: Hand, positions: Set[int]) -> bool:
-        targets = list(
-            filter(lambda pos: hand.cards[pos].number != -1, positions))
-        if len(targets) == 0:
-            return True
-        target = hand.cards[targets[0]]
-        for pos in positions:
-            if target.colour not in hand.cards[pos].colour:
-                return False
-        return True
-
-    def possibilities(self, hand: Hand) -> List[Set[int]]:
-        all_list_possibilities = super().possibilities(hand)
-        return list(filter(lambda possibilities: self.all_same_colour(hand, possibilities), all_list_possibilities))
+    def fused_combinations(self, hand: Hand, full_list: List[int], index: int, remaining: int, acc: int,
+                           target_colour: int = -1):
+        if remaining == 0:
+            yield acc
+            return
+        for position in mask_positions(full_list[index]):
+            colour = hand.colours[position]
+            next_target = target_colour
+            # jokers extend a run of any colour
+            if hand.numbers[position] != -1:
+                if next_target == -1:
+                    next_target = colour
+                elif colour != next_target:
+                    continue
+            yield from self.fused_combinations(
+                hand, full_list, index+1, remaining-1, acc | 1 << position,
+                next_target)
 
 
 class GroupCondition(Condition):
-    def __init__(self, sub_conditions: Set[Condition] = []) -> None:
+    def __init__(self, sub_conditions: Tuple[Condition, ...] = ()) -> None:
         super().__init__(0, sub_conditions)
 
-    def possibilities(self, hand: Hand) -> bool:
+    def cache_key(self) -> Tuple:
+        sub_keys = tuple(condition.cache_key()
+                         for condition in self.sub_conditions)
+        if any(key is None for key in sub_keys):
+            return None
+        return (type(self).__name__, sub_keys)
+
+    def has_possibility(self, hand: Hand) -> bool:
+        key = self.cache_key()
+        if key is not None and key in hand.verdict_cache:
+            return hand.verdict_cache[key]
+        verdict = self.search_possibility(hand)
+        if key is not None:
+            hand.verdict_cache[key] = verdict
+        return verdict
+
+    def search_possibility(self, hand: Hand) -> bool:
+        if len(self.sub_conditions) == 0:
+            return False
+        sub_possibilities = [condition.possibilities(
+            hand) for condition in self.sub_conditions]
+
+        def search(index: int, used: int) -> bool:
+            if index == len(sub_possibilities):
+                return True
+            for possibility in sub_possibilities[index]:
+                if used & possibility == 0 and search(index+1, used | possibility):
+                    return True
+            return False
+
+        return search(0, 0)
+
+    def find_possibilities(self, hand: Hand) -> array.array:
         sub_possibilities = [condition.possibilities(
             hand) for condition in self.sub_conditions]
 
-        remaining_possibilities: List[Set[int]] = []
+        remaining_possibilities = array.array('H')
         for i in range(len(sub_possibilities)):
             if i == 0:
-                remaining_possibilities.extend(sub_possibilities[i])
+                remaining_possibilities.extend(set(sub_possibilities[i]))
             else:
                 b_poss_s = sub_possibilities[i]
-                new_poss = []
-                for a_poss in remaining_possibilities:
-                    for b_poss in b_poss_s:
-                        if a_poss.isdisjoint(b_poss):
-                            new_poss.append(a_poss.union(b_poss))
-                remaining_possibilities = new_poss
+                remaining_possibilities = array.array('H', {
+                    a_poss | b_poss
+                    for a_poss in remaining_possibilities
+                    for b_poss in b_poss_s
+                    if a_poss & b_poss == 0})
         return remaining_possibilities
 
 
@@ -280,6 +363,7 @@ combination = GroupCondition([four_list, four_colours])
 posssibles = combination.possibilities(test_hand)
 
 n_sims = 1e4
+VERBOSE = True
 
 
 class Experiment:
@@ -337,10 +421,9 @@ experiments_done = {
 experiments = {
     "5er+4erfolge": Experiment(GroupCondition([AnyList(5), AnyList(4)])),
 }
-for sim in range(int(n_sims)):
-    deck = init_deck()
-    hand = Hand(deck[0:10])
-    if sim % 100:
+hands = generate_hands(int(n_sims))
+for sim, hand in enumerate(hands):
+    if VERBOSE and sim % 100 == 0:
         print("Sim {}/{} ({} done)".format(sim, n_sims, (sim/n_sims)*100))
     for experiment in experiments:
         experiments[experiment].run(hand)